@@ -1,7 +1,12 @@
-from flask import Flask, jsonify, request, send_file
+from flask import Flask, Response, jsonify, request, send_file
+from flask.json.provider import DefaultJSONProvider
+import orjson
 import logging
 import sys
 import os
+import time
+from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -22,35 +27,102 @@ excel_service = ExcelService()
 pdf_service = PDFService()
 db = WeatherDatabase()
 
+# Caps concurrent Excel/PDF renders per process; request threads just wait on the result
+EXPORT_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix='export')
+
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+class OrjsonProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response instead of round-tripping through str
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=ORJSON_OPTIONS),
+            mimetype=self.mimetype
+        )
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+_ts_cache = (0, '')
+
+def now_iso():
+    # Health checks arrive many times a second; format the wall clock at most once per second
+    global _ts_cache
+    second = int(time.time())
+    if second != _ts_cache[0]:
+        _ts_cache = (second, datetime.fromtimestamp(second).isoformat())
+    return _ts_cache[1]
+
+def _static_json_prefix(payload):
+    # Serialize once and leave the closing brace open so a fresh timestamp can be appended
+    return orjson.dumps(payload)[:-1] + b',"timestamp":"'
+
+def _static_json_response(prefix):
+    return Response(prefix + now_iso().encode() + b'"}', mimetype='application/json')
+
+_HOME_PREFIX = _static_json_prefix({
+    "message": "Weather Service API",
+    "version": "2.0.0",
+    "status": "operational",
+    "features": [
+        "Open-Meteo API integration",
+        "SQLite data storage",
+        "Excel report export",
+        "PDF reports with charts"
+    ],
+    "endpoints": {
+        "weather_report": "/weather-report?lat={lat}&lon={lon}",
+        "export_excel": "/export/excel",
+        "export_pdf": "/export/pdf",
+        "data_summary": "/data/summary",
+        "recent_data": "/data/recent?hours=24",
+        "health": "/health"
+    },
+    "examples": [
+        "curl 'http://localhost:5000/weather-report?lat=47.37&lon=8'",
+        "curl -o weather_data.xlsx 'http://localhost:5000/export/excel'",
+        "curl -o weather_report.pdf 'http://localhost:5000/export/pdf'"
+    ]
+})
+
+_HEALTH_PREFIX = _static_json_prefix({
+    "status": "healthy",
+    "services": {
+        "weather_api": "operational",
+        "database": "operational",
+        "excel_export": "operational",
+        "pdf_export": "operational"
+    },
+    "version": "1.0.0"
+})
+
+def validate_hours(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        hours = request.args.get('hours', default=48, type=int)
+        if hours <= 0 or hours > 168:
+            return jsonify({
+                "error": "Invalid hours parameter (1-168)"
+            }), 400
+        return view(*args, hours=hours, **kwargs)
+    return wrapper
+
+def no_data_response(hours):
+    return jsonify({
+        "error": "No data available",
+        "message": f"No weather data available for the last {hours} hours"
+    }), 404
 
 @app.route('/')
 def home():
-    return jsonify({
-        "message": "Weather Service API",
-        "version": "2.0.0",
-        "status": "operational",
-        "features": [
-            "Open-Meteo API integration",
-            "SQLite data storage",
-            "Excel report export",
-            "PDF reports with charts"
-        ],
-        "endpoints": {
-            "weather_report": "/weather-report?lat={lat}&lon={lon}",
-            "export_excel": "/export/excel",
-            "export_pdf": "/export/pdf",
-            "data_summary": "/data/summary",
-            "recent_data": "/data/recent?hours=24",
-            "health": "/health"
-        },
-        "examples": [
-            "curl 'http://localhost:5000/weather-report?lat=47.37&lon=8'",
-            "curl -o weather_data.xlsx 'http://localhost:5000/export/excel'",
-            "curl -o weather_report.pdf 'http://localhost:5000/export/pdf'"
-        ],
-        "timestamp": datetime.now().isoformat()
-    })
+    return _static_json_response(_HOME_PREFIX)
 
 @app.route('/weather-report', methods=['GET'])
 def get_weather_report():
@@ -92,18 +164,15 @@ def get_weather_report():
         }), 500
 
 @app.route('/export/excel', methods=['GET'])
-def export_excel():
+@validate_hours
+def export_excel(hours):
     try:
-        hours = request.args.get('hours', default=48, type=int)
-        
-        if hours <= 0 or hours > 168:
-            return jsonify({
-                "error": "Invalid hours parameter (1-168)"
-            }), 400
+        if db.count_recent(hours) == 0:
+            return no_data_response(hours)
         
         logger.info(f"Generating Excel report for last {hours} hours")
         
-        excel_file = excel_service.generate_excel_report(db, hours)
+        excel_file = EXPORT_POOL.submit(excel_service.generate_excel_report, db, hours).result()
         
         return send_file(
             excel_file,
@@ -125,18 +194,15 @@ def export_excel():
         }), 500
 
 @app.route('/export/pdf', methods=['GET'])
-def export_pdf():
+@validate_hours
+def export_pdf(hours):
     try:
-        hours = request.args.get('hours', default=48, type=int)
-        
-        if hours <= 0 or hours > 168:
-            return jsonify({
-                "error": "Invalid hours parameter (1-168)"
-            }), 400
+        if db.count_recent(hours) == 0:
+            return no_data_response(hours)
         
         logger.info(f"Generating PDF report for last {hours} hours")
         
-        pdf_file = pdf_service.generate_pdf_report(db, hours)
+        pdf_file = EXPORT_POOL.submit(pdf_service.generate_pdf_report, db, hours).result()
         
         return send_file(
             pdf_file,
@@ -167,20 +233,14 @@ def get_data_summary():
         return jsonify({"error": str(e)}), 500
 
 @app.route('/data/recent', methods=['GET'])
-def get_recent_data():
+@validate_hours
+def get_recent_data(hours):
     try:
-        hours = request.args.get('hours', default=48, type=int)
-        if hours <= 0 or hours > 168:
-            return jsonify({
-                "error": "Invalid hours parameter (1-168)"
-            }), 400
-            
-        data = db.get_recent_data(hours)
         return jsonify({
             "hours_requested": hours,
-            "records_found": len(data),
-            "data": data[:10],
-            "timestamp": datetime.now().isoformat()
+            "records_found": db.count_recent(hours),
+            "data": db.get_recent_data(hours, limit=10),
+            "timestamp": datetime.now()
         })
     except Exception as e:
         logger.error(f"Error getting recent data: {e}")
@@ -188,19 +248,10 @@ def get_recent_data():
 
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({
-        "status": "healthy",
-        "timestamp": datetime.now().isoformat(),
-        "services": {
-            "weather_api": "operational",
-            "database": "operational",
-            "excel_export": "operational",
-            "pdf_export": "operational"
-        },
-        "version": "1.0.0"
-    })
+    return _static_json_response(_HEALTH_PREFIX)
 
 if __name__ == '__main__':
+    # Development server only; serve production traffic with gunicorn (see wsgi.py)
     print("\nStarting Fask Weather Service...")
     print("API available at: http://localhost:5000")
     print("Weather data: curl 'http://localhost:5000/weather-report?lat=47.37&lon=8'")
@@ -208,4 +259,4 @@ if __name__ == '__main__':
     print("PDF report: curl -o weather_report.pdf 'http://localhost:5000/export/pdf'")
     print("Health check: curl 'http://localhost:5000/health'\n")
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    app.run(host='0.0.0.0', port=5000, threaded=True)
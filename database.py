@@ -1,18 +1,74 @@
 import sqlite3
+import pandas as pd
 import logging
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timedelta, timezone
 
 logger = logging.getLogger(__name__)
 
+CACHE_TTL_SECONDS = 30
+RECENT_DATA_LIMIT = 1000
+
 class WeatherDatabase:
     def __init__(self, db_path="weather.db"):
         self.db_path = db_path
+        self._local = threading.local()
+        self._cache = {}
+        self._cache_version = 0
         self.init_database()
     
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA wal_autocheckpoint=1000')
+            conn.execute('PRAGMA temp_store=MEMORY')
+            conn.execute('PRAGMA cache_size=-20000')
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+    
+    def _invalidate_cache(self):
+        self._cache_version += 1
+        self._cache.clear()
+    
+    def _read_version(self):
+        # data_version changes on this connection whenever another connection commits,
+        # including gunicorn workers in other processes that this cache can't otherwise see
+        data_version = self._conn().execute('PRAGMA data_version').fetchone()[0]
+        if data_version != getattr(self._local, 'data_version', None):
+            # A thread's first look can't tell what it missed, so it invalidates too
+            self._local.data_version = data_version
+            self._invalidate_cache()
+        return self._cache_version
+    
+    def _cache_get(self, key, version):
+        entry = self._cache.get((key, version))
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            self._cache.pop((key, version), None)
+            return None
+        return value
+    
+    def _cache_put(self, key, value, version):
+        # version is captured before the read's query; a write that committed since then
+        # has already invalidated this result, so don't store it
+        if version != self._cache_version:
+            return
+        self._cache[(key, version)] = (time.monotonic() + CACHE_TTL_SECONDS, value)
+    
+    @staticmethod
+    def _cutoff(hours):
+        return (datetime.now(timezone.utc) - timedelta(hours=hours)).strftime('%Y-%m-%dT%H:%M:%S')
+    
     def init_database(self):
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            cursor = self._conn().cursor()
             
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS weather_data (
@@ -26,36 +82,50 @@ class WeatherDatabase:
                 )
             ''')
             
-            conn.commit()
-            conn.close()
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_weather_ts
+                ON weather_data(timestamp DESC)
+            ''')
+            
             logger.info("Database initialized successfully")
             
         except Exception as e:
             logger.error(f"Database init error: {e}")
             raise
     
-    def store_weather_data(self, records):
+    def store_weather_data(self, records, bulk=False):
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._conn()
             cursor = conn.cursor()
             
-            count = 0
-            for record in records:
-                cursor.execute('''
-                    INSERT INTO weather_data 
-                    (timestamp, latitude, longitude, temperature_2m, relative_humidity_2m)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (
-                    record['timestamp'],
-                    record['latitude'],
-                    record['longitude'],
-                    record['temperature_2m'],
-                    record['relative_humidity_2m']
-                ))
-                count += 1
-            
-            conn.commit()
-            conn.close()
+            rows = [
+                (r['timestamp'], r['latitude'], r['longitude'],
+                 r['temperature_2m'], r['relative_humidity_2m'])
+                for r in records
+            ]
+            
+            # Backfills can trade crash durability for speed; switched outside the transaction
+            if bulk:
+                conn.execute('PRAGMA synchronous=OFF')
+            try:
+                cursor.execute('BEGIN IMMEDIATE')
+                try:
+                    cursor.executemany('''
+                        INSERT INTO weather_data 
+                        (timestamp, latitude, longitude, temperature_2m, relative_humidity_2m)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', rows)
+                    cursor.execute('COMMIT')
+                except Exception:
+                    cursor.execute('ROLLBACK')
+                    raise
+            finally:
+                if bulk:
+                    conn.execute('PRAGMA synchronous=NORMAL')
+            
+            self._invalidate_cache()
+            
+            count = len(rows)
             logger.info(f"Stored {count} records in database")
             return count
             
@@ -63,34 +133,161 @@ class WeatherDatabase:
             logger.error(f"Store error: {e}")
             raise
     
-    def get_recent_data(self, hours=48):
+    def count_recent(self, hours=48):
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            version = self._read_version()
+            cached = self._cache_get(('count', hours), version)
+            if cached is not None:
+                return cached
             
+            cursor = self._conn().cursor()
             cursor.execute('''
-                SELECT * FROM weather_data 
-                WHERE datetime(timestamp) >= datetime('now', '-{} hours')
+                SELECT COUNT(*) FROM weather_data
+                WHERE timestamp >= ?
+            ''', (self._cutoff(hours),))
+            count = cursor.fetchone()[0]
+            
+            self._cache_put(('count', hours), count, version)
+            return count
+            
+        except Exception as e:
+            logger.error(f"Count error: {e}")
+            raise
+    
+    def get_recent_data(self, hours=48, limit=RECENT_DATA_LIMIT):
+        try:
+            version = self._read_version()
+            cached = self._cache_get(('recent', hours, limit), version)
+            if cached is not None:
+                return cached
+            
+            cursor = self._conn().cursor()
+            
+            cutoff = self._cutoff(hours)
+            
+            cursor.execute('''
+                SELECT id, timestamp, latitude, longitude,
+                       temperature_2m, relative_humidity_2m, created_at
+                FROM weather_data 
+                WHERE timestamp >= ?
                 ORDER BY timestamp DESC
-                LIMIT 1000
-            '''.format(hours))
+                LIMIT ?
+            ''', (cutoff, limit))
+            
+            data = [dict(row) for row in cursor.fetchall()]
+            # A full 1000-row window may be truncated, so only cache smaller pages
+            if len(data) < RECENT_DATA_LIMIT:
+                self._cache_put(('recent', hours, limit), data, version)
+            
+            return data
+            
+        except Exception as e:
+            logger.error(f"Retrieve error: {e}")
+            raise
+    
+    def iter_recent_data(self, hours=48):
+        try:
+            cursor = self._conn().cursor()
+            
+            cutoff = self._cutoff(hours)
+            
+            cursor.execute('''
+                SELECT timestamp, temperature_2m, relative_humidity_2m
+                FROM (
+                    SELECT timestamp, temperature_2m, relative_humidity_2m
+                    FROM weather_data 
+                    WHERE timestamp >= ?
+                    ORDER BY timestamp DESC
+                    LIMIT ?
+                )
+                ORDER BY timestamp
+            ''', (cutoff, RECENT_DATA_LIMIT))
+            
+            yield from cursor
             
-            rows = cursor.fetchall()
-            conn.close()
+        except Exception as e:
+            logger.error(f"Retrieve error: {e}")
+            raise
+    
+    def get_recent_df(self, hours=48):
+        try:
+            version = self._read_version()
+            cached = self._cache_get(('recent_df', hours), version)
+            if cached is not None:
+                return cached
+            
+            df = pd.read_sql_query('''
+                SELECT timestamp, latitude, longitude,
+                       temperature_2m, relative_humidity_2m
+                FROM (
+                    SELECT timestamp, latitude, longitude,
+                           temperature_2m, relative_humidity_2m
+                    FROM weather_data 
+                    WHERE timestamp >= ?
+                    ORDER BY timestamp DESC
+                    LIMIT ?
+                )
+                ORDER BY timestamp
+            ''', self._conn(), params=(self._cutoff(hours), RECENT_DATA_LIMIT), parse_dates=['timestamp'])
             
-            columns = ['id', 'timestamp', 'latitude', 'longitude', 
-                      'temperature_2m', 'relative_humidity_2m', 'created_at']
+            if len(df) < RECENT_DATA_LIMIT:
+                self._cache_put(('recent_df', hours), df, version)
             
-            return [dict(zip(columns, row)) for row in rows]
+            return df
             
         except Exception as e:
             logger.error(f"Retrieve error: {e}")
             raise
     
+    def get_recent_stats(self, hours=48):
+        try:
+            version = self._read_version()
+            cached = self._cache_get(('stats', hours), version)
+            if cached is not None:
+                return cached
+            
+            cursor = self._conn().cursor()
+            
+            # Same window as get_recent_df so the figures match the chart
+            cursor.execute('''
+                SELECT COUNT(*), MIN(timestamp), MAX(timestamp),
+                       MIN(temperature_2m), AVG(temperature_2m), MAX(temperature_2m),
+                       MIN(relative_humidity_2m), AVG(relative_humidity_2m), MAX(relative_humidity_2m),
+                       MAX(id)
+                FROM (
+                    SELECT id, timestamp, temperature_2m, relative_humidity_2m
+                    FROM weather_data 
+                    WHERE timestamp >= ?
+                    ORDER BY timestamp DESC
+                    LIMIT ?
+                )
+            ''', (self._cutoff(hours), RECENT_DATA_LIMIT))
+            row = cursor.fetchone()
+            
+            stats = {
+                "count": row[0],
+                "oldest": row[1],
+                "latest": row[2],
+                "temperature": {"min": row[3], "avg": row[4], "max": row[5]},
+                "humidity": {"min": row[6], "avg": row[7], "max": row[8]},
+                "max_id": row[9]
+            }
+            self._cache_put(('stats', hours), stats, version)
+            
+            return stats
+            
+        except Exception as e:
+            logger.error(f"Stats error: {e}")
+            raise
+    
     def get_data_summary(self):
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            version = self._read_version()
+            cached = self._cache_get('summary', version)
+            if cached is not None:
+                return dict(cached, timestamp=datetime.now().isoformat())
+            
+            cursor = self._conn().cursor()
             
             cursor.execute('SELECT COUNT(*) FROM weather_data')
             total = cursor.fetchone()[0]
@@ -107,9 +304,7 @@ class WeatherDatabase:
             ''')
             locations = cursor.fetchall()
             
-            conn.close()
-            
-            return {
+            summary = {
                 "total_records": total,
                 "unique_locations": len(locations),
                 "date_range": {
@@ -119,6 +314,9 @@ class WeatherDatabase:
                 "locations": [{"lat": loc[0], "lon": loc[1]} for loc in locations],
                 "timestamp": datetime.now().isoformat()
             }
+            self._cache_put('summary', summary, version)
+            
+            return summary
             
         except Exception as e:
             logger.error(f"Summary error: {e}")
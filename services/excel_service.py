@@ -1,70 +1,57 @@
-import pandas as pd
 from io import BytesIO
-from datetime import datetime, timedelta
+from datetime import datetime
+from itertools import chain
 import logging
+import xlsxwriter
 
 logger = logging.getLogger(__name__)
 
+HEADERS = ('timestamp', 'temperature_2m', 'relative_humidity_2m')
+HEADER_FORMAT = {
+    'bold': True,
+    'bg_color': '#366092',
+    'font_color': '#FFFFFF',
+    'align': 'center'
+}
+DATE_FORMAT = {'num_format': 'yyyy-mm-dd hh:mm:ss'}
+NUMBER_FORMAT = {'num_format': '0.00'}
+# constant_memory flushes rows as they are written, so widths can't be auto-sized;
+# size each column from its header and widest value (19-char timestamp, 0.00 floats)
+COLUMN_WIDTHS = tuple(max(len(h), w) + 2 for h, w in zip(HEADERS, (19, 6, 6)))
+
 class ExcelService:
     @staticmethod
     def generate_excel_report(db, hours=48):
         
         try:
-            recent_data = db.get_recent_data(hours)
+            rows = db.iter_recent_data(hours)
+            first = next(rows, None)
             
-            if not recent_data:
+            if first is None:
                 raise ValueError(f"No weather data available for the last {hours} hours")
             
-            df = pd.DataFrame(recent_data)
-            
-            columns_to_export = ['timestamp', 'temperature_2m', 'relative_humidity_2m']
-            df_export = df[columns_to_export].copy()
+            output = BytesIO()
+            workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+            worksheet = workbook.add_worksheet('Weather Data')
             
-            df_export['timestamp'] = pd.to_datetime(df_export['timestamp'])
-            df_export['temperature_2m'] = pd.to_numeric(df_export['temperature_2m'], errors='coerce')
-            df_export['relative_humidity_2m'] = pd.to_numeric(df_export['relative_humidity_2m'], errors='coerce')
+            header_fmt = workbook.add_format(HEADER_FORMAT)
+            date_fmt = workbook.add_format(DATE_FORMAT)
+            num_fmt = workbook.add_format(NUMBER_FORMAT)
             
-            df_export = df_export.sort_values('timestamp')
+            for col, (width, fmt) in enumerate(zip(COLUMN_WIDTHS, (date_fmt, num_fmt, num_fmt))):
+                worksheet.set_column(col, col, width, fmt)
             
-            output = BytesIO()
+            worksheet.write_row(0, 0, HEADERS, header_fmt)
             
-            with pd.ExcelWriter(output, engine='openpyxl', datetime_format='YYYY-MM-DD HH:MM:SS') as writer:
-                df_export.to_excel(
-                    writer, 
-                    sheet_name='Weather Data', 
-                    index=False,
-                    float_format='%.2f'
-                )
-                
-                workbook = writer.book
-                worksheet = writer.sheets['Weather Data']
-                
-                from openpyxl.styles import Font, PatternFill, Alignment
-                
-                header_font = Font(bold=True, color='FFFFFF')
-                header_fill = PatternFill(start_color='366092', end_color='366092', fill_type='solid')
-                
-                for cell in worksheet[1]: 
-                    cell.font = header_font
-                    cell.fill = header_fill
-                    cell.alignment = Alignment(horizontal='center')
-                
-                for column in worksheet.columns:
-                    max_length = 0
-                    column_letter = column[0].column_letter
-                    
-                    for cell in column:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-                    
-                    adjusted_width = min(max_length + 2, 30)
-                    worksheet.column_dimensions[column_letter].width = adjusted_width
+            count = 0
+            for timestamp, temp, humidity in chain((first,), rows):
+                count += 1
+                worksheet.write_datetime(count, 0, datetime.fromisoformat(timestamp), date_fmt)
+                worksheet.write_row(count, 1, (temp, humidity), num_fmt)
             
+            workbook.close()
             output.seek(0)
-            logger.info(f"Generated Excel report with {len(df_export)} records")
+            logger.info(f"Generated Excel report with {count} records")
             
             return output
             
@@ -1,62 +1,90 @@
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
-import pandas as pd
-from datetime import datetime, timedelta
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.lines import Line2D
+from datetime import datetime
 from io import BytesIO
-import base64
 import logging
-from weasyprint import HTML, CSS
-import os
+import threading
 
 logger = logging.getLogger(__name__)
 
+CACHE_SIZE = 8
+CHART_MAX_POINTS = 500
+CHART_MARKER_LIMIT = 100
+PAGE_SIZE = (8.27, 11.69)
+ACCENT_COLOR = '#366092'
+
+# Static page text; only the placeholders are filled per report
+SUMMARY_INFO = (
+    ('Location', '{location}'),
+    ('Date Range', '{date_range}'),
+    ('Data Period', 'Last {hours_covered} hours'),
+    ('Generated', '{generated_at}'),
+    ('Total Records', '{total_records}')
+)
+STATS_COLUMNS = ('Metric', 'Temperature (°C)', 'Humidity (%)')
+STATS_ROWS = (
+    ('Average', '{temperature[avg]:.2f}', '{humidity[avg]:.1f}'),
+    ('Maximum', '{temperature[max]:.2f}', '{humidity[max]:.1f}'),
+    ('Minimum', '{temperature[min]:.2f}', '{humidity[min]:.1f}')
+)
+
 class PDFService:
+    _pdf_cache = {}
+    # Exports run on several pool threads; eviction iterates the dict, so writers must serialize
+    _pdf_cache_lock = threading.Lock()
+    
+    @staticmethod
+    def _cache_put(cache, key, value):
+        with PDFService._pdf_cache_lock:
+            if len(cache) >= CACHE_SIZE:
+                cache.pop(next(iter(cache)))
+            cache[key] = value
+    
     @staticmethod
     def generate_pdf_report(db, hours=48):
         
         try:
-            recent_data = db.get_recent_data(hours)
+            stats = db.get_recent_stats(hours)
             
-            if not recent_data:
+            if stats['count'] == 0:
                 raise ValueError(f"No weather data available for the last {hours} hours")
             
+            # Rows are never updated in place, so the newest id in the window changes on every write to it
+            cache_key = (hours, stats['max_id'], stats['count'])
             
-            df = pd.DataFrame(recent_data)
-            df['timestamp'] = pd.to_datetime(df['timestamp'])
-            df = df.sort_values('timestamp')
+            pdf_bytes = PDFService._pdf_cache.get(cache_key)
+            if pdf_bytes is not None:
+                logger.info(f"Serving cached PDF report with {stats['count']} records")
+                return BytesIO(pdf_bytes)
             
-            chart_base64 = PDFService._create_weather_chart(df)
+            df = db.get_recent_df(hours)
             
+            oldest = datetime.fromisoformat(stats['oldest']).strftime('%Y-%m-%d %H:%M')
+            latest = datetime.fromisoformat(stats['latest']).strftime('%Y-%m-%d %H:%M')
             metadata = {
                 'location': f"Lat: {df['latitude'].iloc[0]:.4f}, Lon: {df['longitude'].iloc[0]:.4f}",
-                'date_range': f"{df['timestamp'].min().strftime('%Y-%m-%d %H:%M')} to {df['timestamp'].max().strftime('%Y-%m-%d %H:%M')}",
+                'date_range': f"{oldest} to {latest}",
                 'generated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                'total_records': len(df),
+                'total_records': stats['count'],
                 'hours_covered': hours
             }
             
-            stats = {
-                'temperature': {
-                    'avg': df['temperature_2m'].mean(),
-                    'max': df['temperature_2m'].max(),
-                    'min': df['temperature_2m'].min()
-                },
-                'humidity': {
-                    'avg': df['relative_humidity_2m'].mean(),
-                    'max': df['relative_humidity_2m'].max(),
-                    'min': df['relative_humidity_2m'].min()
-                }
-            }
-            
-            html_content = PDFService._generate_html_content(metadata, stats, chart_base64)
+            chart = PDFService._create_weather_chart(df)
+            summary = PDFService._create_summary_page(metadata, stats, chart is not None)
             
             output = BytesIO()
-            HTML(string=html_content).write_pdf(output)
+            with PdfPages(output) as pdf:
+                pdf.savefig(summary)
+                if chart is not None:
+                    pdf.savefig(chart, bbox_inches='tight', facecolor='white')
+            
+            if chart is not None:
+                PDFService._cache_put(PDFService._pdf_cache, cache_key, output.getvalue())
             output.seek(0)
             
-            logger.info(f"Generated PDF report with {len(df)} records")
+            logger.info(f"Generated PDF report with {stats['count']} records")
             return output
             
         except Exception as e:
@@ -67,9 +95,18 @@ class PDFService:
     def _create_weather_chart(df):
         
         try:
-            fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 10))
-            
-            ax1.plot(df['timestamp'], df['temperature_2m'], 'r-', linewidth=2, marker='o', markersize=3)
+            if len(df) > CHART_MAX_POINTS:
+                # Ceiling stride, so the plotted count never exceeds CHART_MAX_POINTS
+                df = df.iloc[::-(-len(df) // CHART_MAX_POINTS)]
+            # Markers stop being readable (and cost rasterizer time) on dense series
+            show_markers = len(df) <= CHART_MARKER_LIMIT
+            
+            # Figure() instead of pyplot: no global figure registry shared across worker threads
+            fig = Figure(figsize=(12, 10))
+            ax1, ax2 = fig.subplots(2, 1)
+            
+            ax1.plot(df['timestamp'], df['temperature_2m'], 'r-', linewidth=2,
+                     marker='o' if show_markers else None, markersize=3)
             ax1.set_ylabel('Temperature (°C)', fontsize=12, color='red')
             ax1.set_title('Weather Data - Temperature and Humidity Trends', fontsize=14, fontweight='bold')
             ax1.grid(True, alpha=0.3)
@@ -78,7 +115,8 @@ class PDFService:
             ax1.xaxis.set_major_formatter(mdates.DateFormatter('%m/%d %H:%M'))
             ax1.xaxis.set_major_locator(mdates.HourLocator(interval=6))
             
-            ax2.plot(df['timestamp'], df['relative_humidity_2m'], 'b-', linewidth=2, marker='s', markersize=3)
+            ax2.plot(df['timestamp'], df['relative_humidity_2m'], 'b-', linewidth=2,
+                     marker='s' if show_markers else None, markersize=3)
             ax2.set_ylabel('Relative Humidity (%)', fontsize=12, color='blue')
             ax2.set_xlabel('Time', fontsize=12)
             ax2.grid(True, alpha=0.3)
@@ -87,166 +125,65 @@ class PDFService:
             ax2.xaxis.set_major_formatter(mdates.DateFormatter('%m/%d %H:%M'))
             ax2.xaxis.set_major_locator(mdates.HourLocator(interval=6))
             
-            plt.setp(ax1.xaxis.get_majorticklabels(), rotation=45)
-            plt.setp(ax2.xaxis.get_majorticklabels(), rotation=45)
+            ax1.tick_params(axis='x', labelrotation=45)
+            ax2.tick_params(axis='x', labelrotation=45)
             
-            plt.tight_layout()
+            fig.tight_layout()
             
-            buffer = BytesIO()
-            plt.savefig(buffer, format='png', dpi=300, bbox_inches='tight', facecolor='white')
-            buffer.seek(0)
-            chart_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
-            plt.close(fig)
-            
-            return chart_base64
+            return fig
             
         except Exception as e:
             logger.error(f"Error creating chart: {e}")
-            return ""
+            return None
     
     @staticmethod
-    def _generate_html_content(metadata, stats, chart_base64):
-               
-        html_template = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <title>Weather Data Report</title>
-            <style>
-                body {{ 
-                    font-family: 'Arial', sans-serif; 
-                    margin: 40px; 
-                    color: #333;
-                    line-height: 1.6;
-                }}
-                .header {{ 
-                    text-align: center; 
-                    border-bottom: 3px solid #366092;
-                    padding-bottom: 20px;
-                    margin-bottom: 30px;
-                }}
-                h1 {{ 
-                    color: #366092; 
-                    font-size: 28px;
-                    margin-bottom: 10px;
-                }}
-                .subtitle {{
-                    color: #666;
-                    font-size: 16px;
-                    font-style: italic;
-                }}
-                .metadata {{ 
-                    background-color: #f8f9fa; 
-                    padding: 20px; 
-                    border-radius: 8px; 
-                    margin: 20px 0;
-                    border-left: 4px solid #366092;
-                }}
-                .metadata h3 {{
-                    color: #366092;
-                    margin-top: 0;
-                }}
-                .chart {{ 
-                    text-align: center; 
-                    margin: 30px 0;
-                    page-break-inside: avoid;
-                }}
-                .chart h3 {{
-                    color: #366092;
-                    margin-bottom: 15px;
-                }}
-                .statistics {{ 
-                    margin: 30px 0; 
-                }}
-                .statistics h3 {{
-                    color: #366092;
-                    border-bottom: 2px solid #366092;
-                    padding-bottom: 5px;
-                }}
-                table {{ 
-                    width: 100%; 
-                    border-collapse: collapse; 
-                    margin: 20px 0;
-                    box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-                }}
-                th, td {{ 
-                    border: 1px solid #ddd; 
-                    padding: 12px; 
-                    text-align: center;
-                }}
-                th {{ 
-                    background-color: #366092; 
-                    color: white;
-                    font-weight: bold;
-                }}
-                tr:nth-child(even) {{
-                    background-color: #f9f9f9;
-                }}
-                .footer {{
-                    margin-top: 40px;
-                    padding-top: 20px;
-                    border-top: 1px solid #ddd;
-                    text-align: center;
-                    color: #666;
-                    font-size: 12px;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="header">
-                <h1>Weather Data Report</h1>
-                <div class="subtitle">Weather Analysis Report</div>
-            </div>
-            
-            <div class="metadata">
-                <h3>Report Information</h3>
-                <p><strong>Location:</strong> {metadata['location']}</p>
-                <p><strong>Date Range:</strong> {metadata['date_range']}</p>
-                <p><strong>Data Period:</strong> Last {metadata['hours_covered']} hours</p>
-                <p><strong>Generated:</strong> {metadata['generated_at']}</p>
-                <p><strong>Total Records:</strong> {metadata['total_records']}</p>
-            </div>
-            
-            <div class="chart">
-                <h3>Temperature and Humidity Trends</h3>
-                {f'<img src="data:image/png;base64,{chart_base64}" style="max-width: 100%; height: auto;">' if chart_base64 else '<p>Chart could not be generated</p>'}
-            </div>
-            
-            <div class="statistics">
-                <h3>Statistical Summary</h3>
-                <table>
-                    <tr>
-                        <th>Metric</th>
-                        <th>Temperature (°C)</th>
-                        <th>Humidity (%)</th>
-                    </tr>
-                    <tr>
-                        <td><strong>Average</strong></td>
-                        <td>{stats['temperature']['avg']:.2f}</td>
-                        <td>{stats['humidity']['avg']:.1f}</td>
-                    </tr>
-                    <tr>
-                        <td><strong>Maximum</strong></td>
-                        <td>{stats['temperature']['max']:.2f}</td>
-                        <td>{stats['humidity']['max']:.1f}</td>
-                    </tr>
-                    <tr>
-                        <td><strong>Minimum</strong></td>
-                        <td>{stats['temperature']['min']:.2f}</td>
-                        <td>{stats['humidity']['min']:.1f}</td>
-                    </tr>
-                </table>
-            </div>
-            
-            <div class="footer">
-                <p>Generated by Weather Service API | Data provided by Open-Meteo</p>
-            </div>
-        </body>
-        </html>
-        """
+    def _create_summary_page(metadata, stats, chart_ok):
+        
+        fig = Figure(figsize=PAGE_SIZE)
+        
+        fig.text(0.5, 0.93, 'Weather Data Report', ha='center', fontsize=22,
+                 fontweight='bold', color=ACCENT_COLOR)
+        fig.text(0.5, 0.905, 'Weather Analysis Report', ha='center', fontsize=12,
+                 style='italic', color='#666666')
+        fig.add_artist(Line2D([0.08, 0.92], [0.89, 0.89], color=ACCENT_COLOR, linewidth=2))
+        
+        fig.text(0.08, 0.85, 'Report Information', fontsize=14, fontweight='bold', color=ACCENT_COLOR)
+        for i, (label, template) in enumerate(SUMMARY_INFO):
+            y = 0.815 - i * 0.028
+            fig.text(0.10, y, f"{label}:", fontsize=11, fontweight='bold', color='#333333')
+            fig.text(0.30, y, template.format_map(metadata), fontsize=11, color='#333333')
+        
+        if not chart_ok:
+            fig.text(0.08, 0.64, 'Chart could not be generated', fontsize=11, color='#333333')
+        
+        fig.text(0.08, 0.58, 'Statistical Summary', fontsize=14, fontweight='bold', color=ACCENT_COLOR)
+        ax = fig.add_axes([0.08, 0.40, 0.84, 0.16])
+        ax.axis('off')
+        
+        table = ax.table(
+            cellText=[[cell.format_map(stats) for cell in row] for row in STATS_ROWS],
+            colLabels=STATS_COLUMNS,
+            cellLoc='center',
+            loc='upper center',
+            bbox=[0, 0, 1, 1]
+        )
+        table.auto_set_font_size(False)
+        table.set_fontsize(11)
+        for (row, col), cell in table.get_celld().items():
+            cell.set_edgecolor('#dddddd')
+            if row == 0:
+                cell.set_facecolor(ACCENT_COLOR)
+                cell.get_text().set_color('white')
+                cell.get_text().set_fontweight('bold')
+            elif col == 0:
+                cell.get_text().set_fontweight('bold')
+            if row % 2 == 0 and row > 0:
+                cell.set_facecolor('#f9f9f9')
+        
+        fig.text(0.5, 0.05, 'Generated by Weather Service API | Data provided by Open-Meteo',
+                 ha='center', fontsize=9, color='#666666')
         
-        return html_template
+        return fig
 
 if __name__ == '__main__':
     print("PDF Service module loaded")
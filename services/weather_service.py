@@ -1,73 +1,111 @@
 import openmeteo_requests
 import requests_cache
 from retry_requests import retry
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import numpy as np
 import logging
-import requests
-import json
+import threading
+import time
+from requests.adapters import HTTPAdapter
+import orjson
 
 logger = logging.getLogger(__name__)
 
+# 'records' is a list of row dicts; 'columnar' keeps one numpy array per measurement
+RETURN_FORMATS = ('records', 'columnar')
+# Parsed results live as long as the HTTP cache entries they were built from
+RESULT_CACHE_TTL_SECONDS = 3600
+RESULT_CACHE_SIZE = 256
+BATCH_MAX_WORKERS = 8
+# Expired HTTP responses are kept for stale_if_error, but only this long after they were fetched
+HTTP_CACHE_MAX_AGE = timedelta(hours=2)
+HTTP_CACHE_PURGE_INTERVAL_SECONDS = 600
+
 class WeatherService:
+    FORECAST_URL = "https://api.open-meteo.com/v1/forecast"
+    # Request fields that never change between calls; a tuple so the shared value can't be mutated
+    _PARAMS_TEMPLATE = {
+        "hourly": ("temperature_2m", "relative_humidity_2m"),
+        "timezone": "auto"
+    }
+    
     def __init__(self):
         try:
-            cache_session = requests_cache.CachedSession('.cache', expire_after=3600)
-            retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
+            # In-memory SQLite: no disk I/O on hits, and unlike the dict backend it can purge old entries.
+            # Revalidate expired entries with ETag/Last-Modified, and fall back to them if Open-Meteo is down
+            self.cache_session = requests_cache.CachedSession(
+                'weather_http_cache',
+                backend='sqlite',
+                use_memory=True,
+                expire_after=3600,
+                cache_control=True,
+                stale_if_error=True,
+                allowable_methods=('GET',)
+            )
+            retry_session = retry(self.cache_session, retries=5, backoff_factor=0.2)
+            # Keep retry's policy but raise the pool ceiling so concurrent fetches reuse keep-alive connections
+            pooled = HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=16,
+                max_retries=retry_session.get_adapter('https://').max_retries
+            )
+            retry_session.mount('https://', pooled)
+            retry_session.mount('http://', pooled)
             self.openmeteo = openmeteo_requests.Client(session=retry_session)
+            self._result_cache = {}
+            self._result_cache_lock = threading.Lock()
+            self._next_http_cache_purge = time.monotonic() + HTTP_CACHE_PURGE_INTERVAL_SECONDS
             logger.info("Weather service initialized")
         except Exception as e:
-            logger.error(f"Failed to initialize weather api: {e}")
+            logger.error("Failed to initialize weather api: %s", e)
             raise
     
-    def fetch_weather_data(self, latitude, longitude, days=2):
+    def fetch_weather_data(self, latitude, longitude, days=2, return_format='records'):
         
-        logger.info(f"Starting weather data fetch for: lat={latitude}, lon={longitude}")
+        logger.info("Starting weather data fetch for: lat=%s, lon=%s", latitude, longitude)
         
-        if not isinstance(latitude, (int, float)) or not isinstance(longitude, (int, float)):
+        try:
+            lat = float(latitude)
+            lon = float(longitude)
+        except (TypeError, ValueError):
             raise ValueError(f"Invalid coordinate types: lat={type(latitude)}, lon={type(longitude)}")
         
-        if not (-90 <= latitude <= 90):
-            raise ValueError(f"Invalid latitude: {latitude} (must be between -90 and 90)")
+        if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+            raise ValueError(f"Invalid coordinates: lat={latitude}, lon={longitude} "
+                             "(latitude must be between -90 and 90, longitude between -180 and 180)")
         
-        if not (-180 <= longitude <= 180):
-            raise ValueError(f"Invalid longitude: {longitude} (must be between -180 and 180)")
+        if return_format not in RETURN_FORMATS:
+            raise ValueError(f"Invalid return_format: {return_format} (must be one of {', '.join(RETURN_FORMATS)})")
         
         end_date = datetime.now().date()
         start_date = end_date - timedelta(days=days)
         
-        logger.info(f"Date range: {start_date} to {end_date}")
+        cache_key = (round(lat, 4), round(lon, 4), days, end_date, return_format)
+        entry = self._result_cache.get(cache_key)
+        if entry is not None and time.monotonic() < entry[0]:
+            logger.info("Serving cached weather data for: lat=%s, lon=%s", lat, lon)
+            # Callers annotate the result (e.g. database_stored), so hand out a copy
+            return dict(entry[1])
+        
+        self._purge_http_cache()
         
-        url = "https://api.open-meteo.com/v1/forecast"
+        logger.info("Date range: %s to %s", start_date, end_date)
+        
+        url = self.FORECAST_URL
         params = {
-            "latitude": float(latitude),
-            "longitude": float(longitude),
-            "hourly": ["temperature_2m", "relative_humidity_2m"],
+            **self._PARAMS_TEMPLATE,
+            "latitude": lat,
+            "longitude": lon,
             "start_date": start_date.isoformat(),
-            "end_date": end_date.isoformat(),
-            "timezone": "auto"
+            "end_date": end_date.isoformat()
         }
         
-        logger.info(f"API URL: {url}")
-        logger.info(f"Parameters: {json.dumps(params, indent=2)}")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("API URL: %s", url)
+            logger.info("Parameters: %s", orjson.dumps(params, option=orjson.OPT_INDENT_2).decode())
         
         try:
-            logger.info("Testing with direct requests...")
-            test_response = requests.get(url, params=params, timeout=30)
-            logger.info(f"Direct request status: {test_response.status_code}")
-            
-            if test_response.status_code == 200:
-                test_data = test_response.json()
-                logger.info(f"Direct request successful. Data keys: {list(test_data.keys())}")
-                if 'hourly' in test_data:
-                    hourly_keys = list(test_data['hourly'].keys()) if test_data['hourly'] else []
-                    logger.info(f"Hourly data keys: {hourly_keys}")
-                else:
-                    logger.warning("No 'hourly' key in direct response")
-            else:
-                logger.error(f"Direct request failed: {test_response.status_code} - {test_response.text}")
-                raise Exception(f"API request failed with status {test_response.status_code}")
-            
             logger.info("Making API call with openmeteo client...")
             responses = self.openmeteo.weather_api(url, params=params)
             
@@ -76,19 +114,59 @@ class WeatherService:
             
             response = responses[0]
             
-            logger.info(f"API Response received")
-            logger.info(f"Coordinates: {response.Latitude():.4f}°N, {response.Longitude():.4f}°E")
-            logger.info(f"Elevation: {response.Elevation()}m")
-            logger.info(f"Timezone offset: {response.UtcOffsetSeconds()}s")
+            logger.info("API Response received")
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Coordinates: %.4f°N, %.4f°E", response.Latitude(), response.Longitude())
+                logger.info("Elevation: %sm", response.Elevation())
+                logger.info("Timezone offset: %ss", response.UtcOffsetSeconds())
+            
+            result = self._process_response(response, lat, lon, return_format)
             
-            return self._process_response(response, latitude, longitude)
+            with self._result_cache_lock:
+                if len(self._result_cache) >= RESULT_CACHE_SIZE:
+                    self._result_cache.pop(next(iter(self._result_cache)))
+                self._result_cache[cache_key] = (time.monotonic() + RESULT_CACHE_TTL_SECONDS, result)
+            
+            return dict(result)
             
         except Exception as e:
-            logger.error(f"API Error: {str(e)}")
-            logger.error(f"Error type: {type(e).__name__}")
+            logger.error("API Error: %s", e)
+            logger.error("Error type: %s", type(e).__name__)
             raise Exception(f"Weather API error: {str(e)}")
     
-    def _process_response(self, response, lat, lon):
+    def _purge_http_cache(self):
+        # Keys come from client-supplied coordinates and dates, so the cache must not grow forever
+        with self._result_cache_lock:
+            now = time.monotonic()
+            if now < self._next_http_cache_purge:
+                return
+            self._next_http_cache_purge = now + HTTP_CACHE_PURGE_INTERVAL_SECONDS
+        
+        try:
+            self.cache_session.cache.delete(older_than=HTTP_CACHE_MAX_AGE)
+        except Exception as e:
+            logger.warning("HTTP cache purge failed: %s", e)
+    
+    def fetch_weather_data_batch(self, coordinates, days=2, return_format='records'):
+        
+        coordinates = list(coordinates)
+        if not coordinates:
+            return []
+        
+        # Fetches are network-bound and share the pooled session, so overlap their round-trips.
+        # All-or-nothing: the first failing coordinate's exception propagates and the other results are dropped
+        with ThreadPoolExecutor(max_workers=min(BATCH_MAX_WORKERS, len(coordinates))) as executor:
+            return list(executor.map(
+                lambda coord: self.fetch_weather_data(coord[0], coord[1], days, return_format),
+                coordinates
+            ))
+    
+    @staticmethod
+    def _format_timestamps(epochs):
+        # numpy's ISO formatter at second resolution yields the stored '%Y-%m-%dT%H:%M:%S' form
+        return np.datetime_as_string(np.asarray(epochs, dtype='datetime64[s]'), unit='s').tolist()
+    
+    def _process_response(self, response, lat, lon, return_format='records'):
         
         logger.info("Processing API response...")
         
@@ -96,59 +174,84 @@ class WeatherService:
         if not hourly:
             raise Exception("No hourly data in response")
         
-        hourly_time = range(hourly.Time(), hourly.TimeEnd(), hourly.Interval())
-        time_count = len(list(hourly_time))
-        logger.info(f"Time range: {time_count} time points")
-        
-        hourly_time = range(hourly.Time(), hourly.TimeEnd(), hourly.Interval())
+        ts_array = np.arange(hourly.Time(), hourly.TimeEnd(), hourly.Interval(), dtype=np.int64)
+        logger.info("Time range: %d time points", len(ts_array))
         
         variables_length = hourly.VariablesLength()
-        logger.info(f"Variables count: {variables_length}")
+        logger.info("Variables count: %d", variables_length)
         
         if variables_length < 2:
             raise Exception(f"Expected 2 variables (temperature, humidity), got {variables_length}")
         
-        hourly_variables = list(map(lambda i: hourly.Variables(i), range(0, variables_length)))
-        
-        
-        temp_data = hourly_variables[0].ValuesAsNumpy()
-        humidity_data = hourly_variables[1].ValuesAsNumpy()
+        temp_data = hourly.Variables(0).ValuesAsNumpy()
+        humidity_data = hourly.Variables(1).ValuesAsNumpy()
         
-        logger.info(f"Temperature data points: {len(temp_data)}")
-        logger.info(f"Humidity data points: {len(humidity_data)}")
+        logger.info("Temperature data points: %d", len(temp_data))
+        logger.info("Humidity data points: %d", len(humidity_data))
         
         if len(temp_data) == 0 or len(humidity_data) == 0:
             raise Exception("No temperature or humidity data received")
         
-        records = []
-        valid_records = []
-        
-        for i, timestamp in enumerate(hourly_time):
-            if i < len(temp_data) and i < len(humidity_data):
-                temp = float(temp_data[i]) if not np.isnan(temp_data[i]) else None
-                humidity = float(humidity_data[i]) if not np.isnan(humidity_data[i]) else None
-                
-                record = {
-                    "timestamp": datetime.fromtimestamp(timestamp).isoformat(),
-                    "temperature_2m": round(temp, 2) if temp is not None else None,
-                    "relative_humidity_2m": round(humidity, 1) if humidity is not None else None,
+        n = min(len(ts_array), len(temp_data), len(humidity_data))
+        temps = np.asarray(temp_data[:n], dtype=np.float64)
+        humidities = np.asarray(humidity_data[:n], dtype=np.float64)
+        
+        ts_array = ts_array[:n]
+        temp_nan = np.isnan(temps)
+        humidity_nan = np.isnan(humidities)
+        # Open-Meteo hourly series are usually complete, so only gather when a gap exists
+        if temp_nan.any() or humidity_nan.any():
+            valid = ~(temp_nan | humidity_nan)
+            valid_ts, valid_temps, valid_humidities = ts_array[valid], temps[valid], humidities[valid]
+        else:
+            valid_ts, valid_temps, valid_humidities = ts_array, temps, humidities
+        
+        # One C-level pass each for rounding and formatting
+        timestamps = self._format_timestamps(valid_ts)
+        valid_temps = np.round(valid_temps, 2)
+        valid_humidities = np.round(valid_humidities, 1)
+        valid_count = len(timestamps)
+        
+        if return_format == 'columnar':
+            data = {
+                "timestamp": timestamps,
+                "temperature_2m": valid_temps,
+                "relative_humidity_2m": valid_humidities,
+                "latitude": lat,
+                "longitude": lon
+            }
+            sample_data = {
+                **data,
+                "timestamp": timestamps[:5],
+                "temperature_2m": valid_temps[:5],
+                "relative_humidity_2m": valid_humidities[:5]
+            }
+        else:
+            data = [
+                {
+                    "timestamp": timestamp,
+                    "temperature_2m": temp,
+                    "relative_humidity_2m": humidity,
                     "latitude": lat,
                     "longitude": lon
                 }
-                
-                records.append(record)
-                
-                if temp is not None and humidity is not None:
-                    valid_records.append(record)
-                    
-                if i < 3:
-                    logger.info(f"Sample record {i}: temp={temp}, humidity={humidity}")
-        
-        logger.info(f"Processed {len(records)} total records, {len(valid_records)} valid records")
-        
-        if len(valid_records) == 0:
+                for timestamp, temp, humidity in zip(timestamps, valid_temps.tolist(), valid_humidities.tolist())
+            ]
+            sample_data = data[:5]
+        
+        if logger.isEnabledFor(logging.INFO):
+            for i in range(min(3, n)):
+                temp = None if temp_nan[i] else float(temps[i])
+                humidity = None if humidity_nan[i] else float(humidities[i])
+                logger.info("Sample record %d: temp=%s, humidity=%s", i, temp, humidity)
+        
+        logger.info("Processed %d total records, %d valid records", n, valid_count)
+        
+        if valid_count == 0:
             logger.warning("No valid records found (all data contains NaN values)")
         
+        start, end = self._format_timestamps(ts_array[[0, -1]]) if n else (None, None)
+        
         return {
             "status": "success",
             "metadata": {
@@ -156,15 +259,15 @@ class WeatherService:
                 "longitude": response.Longitude(), 
                 "elevation": response.Elevation(),
                 "timezone_offset": response.UtcOffsetSeconds(),
-                "total_records": len(records),
-                "valid_records": len(valid_records),
+                "total_records": n,
+                "valid_records": valid_count,
                 "date_range": {
-                    "start": records[0]["timestamp"] if records else None,
-                    "end": records[-1]["timestamp"] if records else None
+                    "start": start,
+                    "end": end
                 }
             },
-            "data": valid_records,
-            "sample_data": valid_records[:5] if valid_records else []
+            "data": data,
+            "sample_data": sample_data
         }
 
 if __name__ == '__main__':